@@ -1,49 +1,33 @@
 import argparse
+import array
 import os
+import re
+import struct
 import sys
 import collections
 
 
-class BIOS_RLE_RLEBlock():
-    def __init__(self, byte, length):
-        assert 3 <= length <= 130
-        self.byte = byte
-        self.length = length
-    
-    def output(self, f):
-        flag_byte = 0x80 | (self.length - 3)
-        f.write(flag_byte.to_bytes(1, "little"))
-        f.write(self.byte.to_bytes(1, "little"))
-    
-    def __str__(self):
-        return f"RLEBlock({self.length} x {self.byte:02x})"
+def emit_rle_run(out, byte, length):
+    assert 3 <= length <= 130
+    out.append(0x80 | (length - 3))
+    out.append(byte)
 
 
-class BIOS_RLE_RawBlock():
-    def __init__(self, data):
-        assert 1 <= len(data) <= 128
-        self.data = data
-    
-    def output(self, f):
-        flag_byte = len(self.data) - 1
-        f.write(flag_byte.to_bytes(1, "little"))
-        for byte in self.data:
-            f.write(byte.to_bytes(1, "little"))
-
-    def __str__(self):
-        return "RawBlock(" + " ".join(f"{byte:02x}" for byte in self.data) + ")"
+def emit_rle_raw(out, data):
+    assert 1 <= len(data) <= 128
+    out.append(len(data) - 1)
+    out += data
 
 
 class BIOS_RLE():
     def __init__(self, inb, vram):
-        self.inb = inb
-        self.inl = len(inb)     
+        self.inb = bytes(inb) # normalize once, a no-op when already bytes
+        self.inl = len(inb)
     
     def compress(self):
-        self.blocks = []  # list of RLE or uncompressed blocks
-        self.buffer = []  # buffer for uncompressed bytes
-        i = 0
- 
+        self.data = bytearray()  # flag/data byte stream, written after the header
+        self.buffer = bytearray()  # buffer for uncompressed bytes
+
         """
         Data header (32bit)
           Bit 0-3   Reserved
@@ -56,82 +40,138 @@ class BIOS_RLE():
         Data Byte(s) - N uncompressed bytes, or 1 byte repeated N times
         """
 
-        while i < self.inl:
-            cur = self.inb[i]
-            match = 1
-            for j in range(129): # RLE can be up to 130 bytes long, so current byte + 129
-                pos = i+j+1
-                if pos >= self.inl:
-                    break
-                if self.inb[pos] == cur:
-                    match += 1
-                else:
-                    break
-            
-            if match >= 3: # RLE should be at least 3 bytes
+        buf = self.inb
+
+        # find all runs in one C-level pass so Python only loops once per run,
+        # not once per byte
+        for m in re.finditer(rb"(.)\1*", buf, re.DOTALL):
+            cur = buf[m.start()]
+            run = m.end() - m.start()
+
+            while run >= 3: # RLE should be at least 3 bytes
                 self.flush_buffer() # write the current uncompressed bytes as an uncompressed block
-                self.blocks.append(BIOS_RLE_RLEBlock(cur, match))
-                i += match
-            else:
+                match = min(run, 130) # RLE can be up to 130 bytes long
+                emit_rle_run(self.data, cur, match)
+                run -= match
+
+            # leftover shorter than 3 goes into the uncompressed buffer
+            for _ in range(run):
                 self.buffer.append(cur)
                 if len(self.buffer) == 128: # maximum uncompressed length = 128 bytes
                     self.flush_buffer()
-                i += 1
-        
+
         self.flush_buffer()
         
     def flush_buffer(self):
         if len(self.buffer) > 0:
-            self.blocks.append(BIOS_RLE_RawBlock(self.buffer.copy()))
-            self.buffer = []
-    
+            emit_rle_raw(self.data, self.buffer)
+            self.buffer.clear()
+
     def output(self, f):
-        header = (3 << 4) | (self.inl << 8)
-        f.write(header.to_bytes(4, "little"))
-        
-        for b in self.blocks:
-            b.output(f)
+        assert self.inl < (1 << 24), "BIOS header stores a 24-bit decompressed size"
+        f.write(struct.pack("<I", (3 << 4) | (self.inl << 8)) + self.data)
 
 
 #######################################
 
 
-class BIOS_LZ77_RawBlock():
-    def __init__(self, data):
-        self.data = data # one byte
-    
-    def output(self, f):
-        f.write(self.data.to_bytes(1, "little"))
+def emit_lz77_backref(out, disp, length):
+    assert 0 <= disp < 4096
+    assert 3 <= length <= 18
+    out.append(((length-3) << 4) | (disp >> 8))
+    out.append(disp & 0xFF)
+
+
+# hot loop of the LZ77 compressor, kept as a free function working purely on
+# locals so the search itself does no attribute lookups or object allocation;
+# returns a list of (length, disp) pairs with disp = -1 for a raw byte
+def lz77_find_matches(buf, vram):
+    inl = len(buf)
+    matches = []
+    min_disp = 1 if vram else 0
+    i = 0
+
+    # DEFLATE-style hash chains over 3-byte prefixes: head[h] is the most
+    # recent position whose first three bytes hash to h, prev[pos] the one
+    # before it. A match needs length >= 3 so this indexes every candidate
+    # while skipping nearly all positions that can't match at all.
+    head = array.array("i", [-1]) * 65536
+    prev = array.array("i", [-1]) * inl
+
+    # the hash is inlined at both use sites below: a Python function call per
+    # position costs more than the hash itself
+    append = matches.append
+
+    while i < inl:
+        # look for match
+        best_len = 2
+        best_disp = -1
+        limit = min(18, inl - i) # 18 is the maximum match length
+
+        if i + 2 < inl:
+            pos = head[((buf[i] << 10) ^ (buf[i+1] << 5) ^ buf[i+2]) & 0xFFFF]
+        else:
+            pos = -1
+        while pos != -1:
+            disp = i-pos-1
+            if disp >= 4096:
+                break
+            if disp < min_disp:
+                pos = prev[pos]
+                continue
+
+            # a candidate is only interesting if it beats the current best
+            # by at least one byte; a single slice compare rejects it (and
+            # any hash collision) outright
+            trylen = best_len + 1
+            if trylen > limit:
+                break
+            if buf[pos:pos+trylen] == buf[i:i+trylen]:
+                # compare the whole remaining window in one go; memcmp uses
+                # wide compares internally, so this usually settles the match
+                # without ever touching individual bytes
+                if buf[pos:pos+limit] == buf[i:i+limit]:
+                    match_len = limit
+                else:
+                    match_len = trylen
+                    while match_len < limit and buf[pos+match_len] == buf[i+match_len]:
+                        match_len += 1
 
-    def __str__(self):
-        return f"RawBlock({self.data:02x})"
+                best_len = match_len
+                best_disp = disp
+                if match_len == limit: # no later candidate can do better
+                    break
 
+            pos = prev[pos]
 
-class BIOS_LZ77_BackReferenceBlock():
-    def __init__(self, disp, length):
-        self.disp = disp
-        self.length = length
-    
-    def output(self, f):
-        assert 0 <= self.disp < 4096
-        assert 3 <= self.length <= 18
-        f.write((((self.length-3) << 4) | (self.disp >> 8)).to_bytes(1, "little"))
-        f.write((self.disp & 0xFF).to_bytes(1, "little"))
+        if best_disp == -1:
+            # no match
+            length = 1
+            append((1, -1))
+        else:
+            # match
+            length = best_len
+            append((best_len, best_disp))
 
-    def __str__(self):
-        return f"BackReferenceBlock(len={self.length}, disp={self.disp})"
+        # enter every position we skip over into the chains
+        for j in range(i, min(i+length, inl-2)):
+            h = ((buf[j] << 10) ^ (buf[j+1] << 5) ^ buf[j+2]) & 0xFFFF
+            prev[j] = head[h]
+            head[h] = j
+        i += length
+
+    return matches
 
 
 class BIOS_LZ77:
     def __init__(self, inb, vram):
-        self.inb = inb
+        self.inb = bytes(inb) # normalize once, a no-op when already bytes
         self.inl = len(inb)
         self.vram = vram
 
     def compress(self):
-        self.blocks = []  # list of compressed blocks, uncompressed bytes
-        i = 0
-    
+        self.data = bytearray()  # flag/block byte stream, written after the header
+
         """
         Data header (32bit)
           Bit 0-3   Reserved (0)
@@ -147,145 +187,110 @@ class BIOS_LZ77:
           Bit 4-7   Number of bytes to copy (minus 3)
           Bit 8-15  Disp LSBs
         """
-        
-        # map each byte to a list of indices where this byte is seen to speed up compression
-        memory = [[] for _ in range(256)]
-        
-        while i < self.inl:
-            cur = self.inb[i]
-            
-            # look for match
-            best_match = (2, -1) # (length, disp)
-            
-            for pos in reversed(memory[cur]): # only consider positions with the same byte as cur
-                disp = i-pos-1
-                if disp < (1 if self.vram else 0):
-                    continue
-                if disp >= 4096:
-                    break
-                
-                match_len = 0
-                for j in range(18):
-                    if not (0 <= (i-disp-1+j) < self.inl):
-                        break
-                    
-                    if (i+j) >= self.inl:
-                        break
-                
-                    if self.inb[i-disp-1+j] == self.inb[i+j]:
-                        match_len += 1
-                    else:
-                        break
-                if match_len > best_match[0]:
-                    best_match = (match_len, disp)
-                    if match_len == 18: # 18 is the maximum length so we don't need to keep searching for a better one
-                        break
-            
-            if best_match[1] == -1:
-                # no match
-                memory[cur].append(i)
-                self.blocks.append(BIOS_LZ77_RawBlock(cur))
-                i += 1
-            else:
-                # match
-                for j in range(i, i+best_match[0]):
-                    memory[self.inb[j]].append(j)
-                self.blocks.append(BIOS_LZ77_BackReferenceBlock(best_match[1], best_match[0]))
-                i += best_match[0]
-
-    def output(self, f):
-        header = (1 << 4) | (self.inl << 8)
-        f.write(header.to_bytes(4, "little"))
-        
-        for i, b in enumerate(self.blocks):
-            if (i % 8) == 0:
-                # flag byte for the next 8 blocks
-                flag = 0
-                for j, b2 in enumerate(self.blocks[i:i+8]):
-                    # MSB first, bit = 1 for compressed
-                    if type(b2) == BIOS_LZ77_BackReferenceBlock:
-                        flag |= 1 << (7-j)
-                f.write(flag.to_bytes(1, "little"))
-            b.output(f)
 
+        buf = self.inb
 
+        # encode blocks as they come in, buffering 8 at a time so the flag
+        # byte can be written in front of its group
+        flag = 0
+        nblk = 0
+        chunk = bytearray()
+        i = 0
+        for length, disp in lz77_find_matches(buf, self.vram):
+            if disp == -1:
+                chunk.append(buf[i])
+            else:
+                flag |= 1 << (7-nblk) # MSB first, bit = 1 for compressed
+                emit_lz77_backref(chunk, disp, length)
+            nblk += 1
+            i += length
+
+            if nblk == 8:
+                self.data.append(flag)
+                self.data += chunk
+                flag = 0
+                nblk = 0
+                chunk.clear()
 
-#######################################
+        if nblk > 0:
+            self.data.append(flag)
+            self.data += chunk
 
+    def output(self, f):
+        assert self.inl < (1 << 24), "BIOS header stores a 24-bit decompressed size"
+        f.write(struct.pack("<I", (1 << 4) | (self.inl << 8)) + self.data)
 
 
-# Queue of (weight, item) tuples, get() returns the tuple with the lowest weight and removes it
-class PriorityQueue():
-    def __init__(self):
-        self.q = []
 
-    def put(self, t):
-        self.q.append(t)
-        self.q = sorted(self.q, key=lambda x: x[0])
+#######################################
 
-    def qsize(self):
-        return len(self.q)
 
-    def get(self):
-        assert len(self.q) > 0
-        pop = self.q[0]
-        self.q = self.q[1:]
-        return pop
 
-class LeafNode():
-    def __init__(self, symbol, weight):
-        self.symbol = symbol
-        self.weight = weight
-        self.encoding = ""
+# The Huffman tree is stored as parallel arrays instead of node objects:
+# node n is a leaf iff left[n] == -1, in which case symbol[n] holds its value;
+# otherwise left[n]/right[n] are the child0/child1 indices. The leaves occupy
+# indices 0..num_leaves-1 in input order, merged nodes are appended after.
 
-class InnerNode():
-    def __init__(self, child0=None, child1=None):
-        self.child0 = child0
-        self.child1 = child1
-        if child0 is not None and child1 is not None:
-            self.weight = child0.weight + child1.weight
+# walk the tree and collect every leaf's encoding as a (length, bits) pair of
+# plain ints; iterative so deep (skewed) trees don't hit the recursion limit
+def set_encoding(symbol, left, right, root):
+    convdict = dict()
+    todo = [(root, 0, 0)]
+    while todo:
+        node, length, bits = todo.pop()
+        if left[node] != -1:
+            todo.append((left[node], length+1, bits << 1))
+            todo.append((right[node], length+1, (bits << 1) | 1))
         else:
-            self.weight = None
-
-# loop over the nodes and get the leaf nodes the correct encoding (string of zeroes and ones)
-def set_encoding(node, prefix):
-    if type(node) == InnerNode:
-        set_encoding(node.child0, prefix+"0")
-        set_encoding(node.child1, prefix+"1")
-    else:
-        node.encoding = prefix
+            convdict[symbol[node]] = (length, bits)
+    return convdict
 
 
 def construct_tree(inp):
-    leaves = [LeafNode(x[0], x[1]) for x in inp]
-    prio = PriorityQueue()
-    for node in leaves:
-        prio.put((node.weight, node))
-
-    while prio.qsize() > 1:
+    symbol = []
+    weight = []
+    for sym, w in inp:
+        symbol.append(sym)
+        weight.append(w)
+    num_leaves = len(symbol)
+    left = [-1] * num_leaves
+    right = [-1] * num_leaves
+
+    # two-queue merge (van Leeuwen): with the leaves sorted by weight, merged
+    # nodes are created in non-decreasing weight order, so the two lightest
+    # nodes always sit at the heads of the two queues and no heap is needed
+    q1 = collections.deque(sorted(range(num_leaves), key=lambda n: weight[n]))
+    q2 = collections.deque()
+
+    def pop_lightest():
+        # on equal weights take the leaf queue first, matching the old heap's
+        # preference for lower node indices
+        if not q2 or (q1 and weight[q1[0]] <= weight[q2[0]]):
+            return q1.popleft()
+        return q2.popleft()
+
+    while len(q1) + len(q2) > 1:
         # merge the two nodes with the lowest weight
-        pop0 = prio.get()[1]
-        pop1 = prio.get()[1]
-        join = InnerNode(pop0, pop1)
-        prio.put((join.weight, join))
+        pop0 = pop_lightest()
+        pop1 = pop_lightest()
+        join = len(symbol)
+        symbol.append(-1)
+        weight.append(weight[pop0] + weight[pop1])
+        left.append(pop0)
+        right.append(pop1)
+        q2.append(join)
 
-    assert prio.qsize() == 1
-    root = prio.get()[1]
-    assert prio.qsize() == 0
+    root = q2[0] if q2 else q1[0]
 
-    set_encoding(root, "")
-
-    convdict = dict()
-    for l in leaves:
-        convdict[l.symbol] = l.encoding
+    convdict = set_encoding(symbol, left, right, root)
 
-    return root, leaves, convdict
+    return symbol, left, right, root, convdict
 
 
 
 class BIOS_Huffman:
     def __init__(self, inb, vram, symbolsize):
-        self.inb = inb
+        self.inb = bytes(inb) # normalize once, a no-op when already bytes
         self.inl = len(inb)
         self.symbolsize = symbolsize # 4 or 8 bits
 
@@ -312,74 +317,92 @@ class BIOS_Huffman:
           Bit0-31  Node Bits (Bit31=First Bit)  (0=Node0, 1=Node1)
         """
         
-        # make a tree first
+        # make a tree first; counting a bytes object stays on Counter's C fast
+        # path and iterates a compact buffer instead of a list of boxed ints
         counter = collections.Counter(self.inb)
-        self.root, self.leaves, self.convdict = construct_tree(counter.items())
-        self.bits = []
-        
+        self.symbol, self.left, self.right, self.root, self.convdict = construct_tree(counter.items())
+
         #print(self.convdict)
-        
-        # just create a big string of bits
+
+        # pack the bitstream MSB-first into bytes with a running bit accumulator
+        packed = bytearray()
+        convdict = self.convdict
+        acc = 0
+        nbits = 0
+        total = 0
         for cur in self.inb:
-            self.bits += self.convdict[cur]
+            length, bits = convdict[cur]
+            acc = (acc << length) | bits
+            nbits += length
+            total += length
+            while nbits >= 8:
+                nbits -= 8
+                packed.append((acc >> nbits) & 0xFF)
+                acc &= (1 << nbits) - 1
+
+        if nbits > 0: # flush the partial last byte, padded with zero bits
+            packed.append((acc << (8 - nbits)) & 0xFF)
+
+        self.packed = packed
+        self.total_bits = total
     
     def output(self, f):
-        header = self.symbolsize | (2 << 4) | (self.inl << 8)
-        f.write(header.to_bytes(4, "little"))
-        
+        # assemble everything in memory and write it with a single call
+        out = bytearray()
+        assert self.inl < (1 << 24), "BIOS header stores a 24-bit decompressed size"
+        out += struct.pack("<I", self.symbolsize | (2 << 4) | (self.inl << 8))
+
+        symbol, left, right = self.symbol, self.left, self.right
+        num_leaves = (len(symbol) + 1) // 2 # the tree is full, so #nodes = 2*#leaves-1
+
         # tree size = # of leaves minus one, don't do -1 if the # is odd because we insert two more bytes below in that case to retain word alignment
-        f.write((len(self.leaves) - 1 + (len(self.leaves) % 1)).to_bytes(1, "little"))
-        
+        out.append(num_leaves - 1 + (num_leaves % 1))
+
         # do breadth-first search over the tree
-        todo = [self.root]
+        todo = collections.deque([self.root])
         fully = [self.root] # all nodes in breadth-first order
         while len(todo) > 0:
-            pop = todo[0]
-            todo = todo[1:]
-            if type(pop) == InnerNode:
-                todo.append(pop.child0)
-                todo.append(pop.child1)
-                fully.append(pop.child0)
-                fully.append(pop.child1)
-        
-        
+            pop = todo.popleft()
+            if left[pop] != -1:
+                todo.append(left[pop])
+                todo.append(right[pop])
+                fully.append(left[pop])
+                fully.append(right[pop])
+
+        # position of each node in fully, so we don't have to .index() per node
+        pos = [0] * len(symbol)
+        for i, node in enumerate(fully):
+            pos[node] = i
+
         for i, node in enumerate(fully):
-            if type(node) == InnerNode:
-                child0pos = fully.index(node.child0)
-                child1pos = fully.index(node.child1)
+            if left[node] != -1:
+                child0pos = pos[left[node]]
+                child1pos = pos[right[node]]
                 assert child0pos + 1 == child1pos # my child0 and child1 should be next to each other
                 offs = (child1pos - ((i + 1) & ~1) - 2)//2
                 assert 0 <= offs < 0x40  # offset should fit in 6 bits, if this assert fails, your tree is too wide (large & relatively balanced)
 
-                if type(node.child0) == LeafNode:
+                if left[left[node]] == -1:
                     offs |= 0x80
-                if type(node.child1) == LeafNode:
+                if left[right[node]] == -1:
                     offs |= 0x40
 
-                f.write(offs.to_bytes(1, byteorder="little"))
+                out.append(offs)
             else:
-                f.write(node.symbol.to_bytes(1, byteorder="little"))
-        
+                out.append(symbol[node])
+
         if ((len(fully)+1) % 4) == 2:
             # need to add two bytes so that the next word is word aligned
-            f.write((0).to_bytes(2, byteorder="little"))
-        
-        # go over self.bits, turn it into words (bit 31 first)
-        word = 0
-        bitpos = 31
-        for char in self.bits:
-            assert char in {"0", "1"}
-            if char == "1":
-                word |= 1 << bitpos
-            
-            bitpos -= 1
-            if bitpos == -1:
-                f.write(word.to_bytes(4, byteorder="little"))
-                word = 0
-                bitpos = 31
-        
-        if bitpos < 31:
-            f.write(word.to_bytes(4, byteorder="little"))
+            out += b"\x00\x00"
+
+        # the packed bitstream is MSB-first, so a word with bit 31 first is just
+        # its 4 bytes read big-endian; pad to whole words and byte-swap each one
+        packed = bytes(self.packed)
+        packed += b"\x00" * ((-len(packed)) % 4)
+        for (word,) in struct.iter_unpack(">I", packed):
+            out += struct.pack("<I", word)
+
+        f.write(out)
 
 
 #######################################
@@ -399,16 +422,16 @@ def main():
     args = parser.parse_args()
     
     f = open(args.inp, "rb")
-    inb = list(f.read())
+    inb = f.read() # kept as bytes; indexing yields ints and nothing needs more
     f.close()
-    
+
     if len(inb) == 0:
         print("Input is empty, aborting")
         sys.exit(-1)
-      
+
     if (len(inb) % 4) != 0:
         print("Warning: input length is not a multiple of 4, padding with zeroes")
-        inb += (4-(len(inb) % 4)) * [0]
+        inb += (4-(len(inb) % 4)) * b"\x00"
     
     if args.rle:
         obj = BIOS_RLE(inb, args.vram)
@@ -417,12 +440,13 @@ def main():
     elif args.huffman:
         obj = BIOS_Huffman(inb, args.vram, 8)
     elif args.huffman4:
-        # turn list of bytes into list of nibbles, then continue normally
-        inb2 = []
-        for byte in inb:
-            inb2.append(byte & 0xF)
-            inb2.append(byte >> 4)
-        
+        # turn the bytes into a nibble stream, then continue normally;
+        # translate() pulls out all low/high nibbles in one C pass each and
+        # extended slice assignment interleaves them, no per-byte Python loop
+        inb2 = bytearray(2 * len(inb))
+        inb2[0::2] = inb.translate(bytes(b & 0xF for b in range(256)))
+        inb2[1::2] = inb.translate(bytes(b >> 4 for b in range(256)))
+
         obj = BIOS_Huffman(inb2, args.vram, 4)
     else:
         print("No compression method selected, aborting")